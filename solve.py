@@ -1,49 +1,233 @@
 #!/usr/bin/env python3
 
 import sys
-import math
+
+import numpy as np
+from numba import njit, prange
+from scipy.spatial.distance import cdist, pdist, squareform
+
 from common import print_tour, read_input
 
-def distance(city1, city2):
-    """2つの都市間のユークリッド距離を計算する"""
-    return math.sqrt((city1[0] - city2[0]) ** 2 + (city1[1] - city2[1]) ** 2)
+# これより都市数が多い場合は上三角だけを計算する pdist を使う
+PDIST_THRESHOLD = 5000
+
+# 2-optで繋ぎ変え先の候補にする近傍都市の数
+NEIGHBOR_K = 20
+# Or-optで移動させる区間の長さ
+OR_OPT_SEGMENT_LENGTHS = (1, 2, 3)
+# 浮動小数点の誤差で同じ繋ぎ変えを繰り返さないよう、これより大きく改善する場合だけ採用する
+IMPROVEMENT_EPS = 1e-3
+# 全ての辺の組を調べる2-optで、1つのタイルとしてまとめて扱うiとjの幅
+TWO_OPT_TILE = 64
+
+@njit(cache=True)
+def _reverse(tour, pos, a, b):
+    """tour[a..b]を新しい配列を作らずにその場で逆順にし、posも更新する"""
+    while a < b:
+        tour[a], tour[b] = tour[b], tour[a]
+        pos[tour[a]] = a
+        pos[tour[b]] = b
+        a += 1
+        b -= 1
+
+@njit(cache=True)
+def _apply_two_opt(tour, pos, p, q):
+    """辺(p, p+1)と辺(q, q+1)を辺(p, q)と辺(p+1, q+1)に繋ぎ変える"""
+    if p < q:
+        _reverse(tour, pos, p + 1, q)
+    else:
+        _reverse(tour, pos, q + 1, p)
+
+@njit(cache=True, fastmath=True)
+def _two_opt(tour, pos, dist, neighbors, dlb):
+    """
+    近傍リストを使った2-opt法の1周分を実行し、改善があったかどうかを返す
+    dlb[city] が立っている都市は前回調べて改善がなかったので飛ばす (don't look bit)
+    """
+    N = tour.shape[0]
+    improved = False
+    for start in range(N):
+        a = tour[start]
+        if dlb[a]:
+            continue
+        moved = False
+        # tour上でaの次の都市・前の都市との辺をそれぞれ切る候補にする
+        for direction in (1, -1):
+            # 繋ぎ変えでaの位置が変わることがあるので毎回取り直す
+            i = pos[a]
+            p = i if direction == 1 else (i - 1) % N
+            b = tour[(i + direction) % N]
+            for c in neighbors[a]:
+                # 近い順に並んでいるので、これ以上遠い候補では改善できない
+                if dist[a, c] >= dist[a, b]:
+                    break
+                j = pos[c]
+                d = tour[(j + direction) % N]
+                if c == b or d == a:
+                    continue
+
+                # 辺(a, b)と辺(c, d)を辺(a, c)と辺(b, d)に繋ぎ変える
+                current_dist = dist[a, b] + dist[c, d]
+                new_dist = dist[a, c] + dist[b, d]
+
+                if new_dist < current_dist:
+                    q = j if direction == 1 else (j - 1) % N
+                    _apply_two_opt(tour, pos, p, q)
+                    # 繋ぎ変えた辺の端点は周りが変わったので、もう一度調べ直す
+                    dlb[a] = False
+                    dlb[b] = False
+                    dlb[c] = False
+                    dlb[d] = False
+                    improved = True
+                    moved = True
+                    break
+        if not moved:
+            dlb[a] = True
+    return improved
+
+@njit(cache=True, fastmath=True, parallel=True)
+def _two_opt_best_move(tour, dist):
+    """全ての辺の組について2-optの改善量を並列に調べ、最も良い繋ぎ変え (delta, i, j) を返す"""
+    N = tour.shape[0]
+    # 各iの最良の候補は別々の要素に書き込むので、スレッド間で競合しない
+    best_delta = np.zeros(N)
+    best_j = np.full(N, -1, dtype=np.int64)
+    # edge_cost[i] は辺(tour[i], tour[i+1])の長さ。今の辺の長さは距離行列を引かずにここから読む
+    edge_cost = np.empty(N, dtype=dist.dtype)
+    for i in range(N):
+        edge_cost[i] = dist[tour[i], tour[(i + 1) % N]]
+    # (i, j) をTWO_OPT_TILE四方のタイルに分けて調べ、同じ行の距離をキャッシュに載せたまま使い回す
+    n_tiles = (N - 1 + TWO_OPT_TILE - 1) // TWO_OPT_TILE
+    for t in prange(n_tiles):
+        i_start = t * TWO_OPT_TILE
+        i_end = min(i_start + TWO_OPT_TILE, N - 1)
+        for j_start in range(i_start + 2, N, TWO_OPT_TILE):
+            for i in range(i_start, i_end):
+                a, b = tour[i], tour[i + 1]
+                # i=0のときは辺(N-1, 0)が辺(0, 1)と接するので除く
+                j_end = min(j_start + TWO_OPT_TILE, N if i > 0 else N - 1)
+                for j in range(max(i + 2, j_start), j_end):
+                    c, d = tour[j], tour[(j + 1) % N]
+                    delta = (dist[a, c] + dist[b, d]) - (edge_cost[i] + edge_cost[j])
+                    if delta < best_delta[i]:
+                        best_delta[i] = delta
+                        best_j[i] = j
+    i = np.argmin(best_delta)
+    return best_delta[i], i, best_j[i]
+
+@njit(cache=True, fastmath=True)
+def _or_opt(tour, pos, dist, seg_len, dlb):
+    """長さseg_lenの区間を別の辺の間へ移すOr-opt法の1周分を実行し、改善があったかどうかを返す"""
+    N = tour.shape[0]
+    improved = False
+    if N < seg_len + 3:
+        return improved
+    for i in range(1, N - seg_len + 1):
+        # 区間 tour[i..e] を取り除き、前後の都市p, nを直接つなぐ
+        e = i + seg_len - 1
+        p, s0 = tour[i - 1], tour[i]
+        s1, n = tour[e], tour[(e + 1) % N]
+        removal_gain = dist[p, s0] + dist[s1, n] - dist[p, n]
+        if removal_gain <= IMPROVEMENT_EPS:
+            continue
+
+        for j in range(N):
+            # 区間に接している辺には挿入できない
+            if i - 1 <= j <= e:
+                continue
+            # 辺(c, d)の間に区間をそのままの向き、または逆向きで挿入する
+            c, d = tour[j], tour[(j + 1) % N]
+            forward_cost = dist[c, s0] + dist[s1, d] - dist[c, d]
+            reverse_cost = dist[c, s1] + dist[s0, d] - dist[c, d]
+            reverse = reverse_cost < forward_cost
+            if min(forward_cost, reverse_cost) >= removal_gain - IMPROVEMENT_EPS:
+                continue
+
+            # 区間の移動は隣り合うブロックの入れ替えなので、反転の組み合わせで行う
+            if j > e:
+                # [区間][e+1..j] -> [e+1..j][区間]
+                if not reverse:
+                    _reverse(tour, pos, i, e)
+                _reverse(tour, pos, e + 1, j)
+                _reverse(tour, pos, i, j)
+            else:
+                # [j+1..i-1][区間] -> [区間][j+1..i-1]
+                if not reverse:
+                    _reverse(tour, pos, i, e)
+                _reverse(tour, pos, j + 1, i - 1)
+                _reverse(tour, pos, j + 1, e)
+            # 辺が変わった都市は2-optで調べ直す
+            dlb[p] = False
+            dlb[n] = False
+            dlb[s0] = False
+            dlb[s1] = False
+            dlb[c] = False
+            dlb[d] = False
+            improved = True
+            break
+    return improved
+
+def cheapest_insertion(tour, points, dist_matrix):
+    """挿入コストが最小になる点と位置を毎回選びながら、pointsの点を全てtourに挿入する"""
+    unvisited = list(points)
+    # route[:L] が現在のルート。route[L] に先頭の都市を置いておき、(i + 1) % L の計算を省く
+    L = len(tour)
+    route = np.empty(L + len(unvisited) + 1, dtype=np.int64)
+    route[:L] = tour
+    route[L] = route[0]
+    while unvisited:
+        U = np.array(unvisited)
+        # rows[e] は route[e] から各未訪問点までの距離で、辺eの始点と辺e-1の終点で共用する
+        rows = dist_matrix[np.ix_(route[:L + 1], U)]
+        edge_lens = dist_matrix[route[:L], route[1:L + 1]]
+        # cost[e, k] は辺(route[e], route[e+1])の間に点U[k]を挿入したときの経路長の増分
+        cost = rows[:-1] + rows[1:] - edge_lens[:, None]
+        edge_idx, k = np.unravel_index(cost.argmin(), cost.shape)
+        # 挿入位置より後ろを末尾の番兵ごと1つずらして空きを作る
+        route[edge_idx + 2:L + 2] = route[edge_idx + 1:L + 1]
+        route[edge_idx + 1] = unvisited.pop(k)
+        L += 1
+    tour[:] = route[:L].tolist()
 
 def solve(cities):
     """
     複数の戦略を組み合わせて巡回セールスマン問題を解く
     1. 前処理: 孤立した点を先に処理する
     2. 構築: 凸包＋挿入法で質の高い初期ルートを作成する
-    3. 改善: 2-opt法でルートを局所最適化し、交差を解消する
+    3. 改善: 2-opt法とOr-opt法でルートを局所最適化し、交差を解消する
     """
-    N = len(cities)
+    pts = np.asarray(cities, dtype=np.float64)
+    N = pts.shape[0]
     if N == 0:
         return []
 
-    # 全ての都市間の距離を事前に計算しておく
-    dist_matrix = [[0] * N for _ in range(N)]
-    for i in range(N):
-        for j in range(i, N):
-            dist_matrix[i][j] = dist_matrix[j][i] = distance(cities[i], cities[j])
+    # 全ての都市間の距離の2乗を事前に計算しておく
+    # 局所探索はメモリ帯域が律速になるので、float32で持って転送量を半分にする
+    if N > PDIST_THRESHOLD:
+        dist_sq = squareform(pdist(pts, 'sqeuclidean').astype(np.float32))
+    else:
+        dist_sq = cdist(pts, pts, 'sqeuclidean').astype(np.float32)
 
     # --- ステップ1: 孤立点の処理（前処理）---
-    # 各点から最も近い点までの距離を計算
-    nearest_dists = []
-    for i in range(N):
-        min_dist = float('inf')
-        for j in range(N):
-            if i == j: continue
-            min_dist = min(min_dist, dist_matrix[i][j])
-        nearest_dists.append(min_dist)
+    # 各点から最も近い点までの距離の2乗を計算（自分自身を除くため対角を一時的に無限大にする）
+    # 大小比較だけなら平方根は不要なので、2乗のまま最小値を取る
+    np.fill_diagonal(dist_sq, np.inf)
+    nearest_dists_sq = dist_sq.min(axis=1)
+    np.fill_diagonal(dist_sq, 0.0)
+    # 以降の処理では実際の距離が必要なので、その場で平方根を取る
+    dist_matrix = np.sqrt(dist_sq, out=dist_sq)
     
     # 平均の最近傍距離を計算し、それを基に孤立点の閾値を設定
-    avg_nearest_dist = sum(nearest_dists) / N if N > 0 else 0
+    avg_nearest_dist = np.sqrt(nearest_dists_sq).mean()
     # 平均の1.5倍以上離れている点を「孤立点」と見なす
     isolation_threshold = avg_nearest_dist * 1.5 
+    isolation_threshold_sq = isolation_threshold ** 2
     
-    isolated_indices = {i for i, d in enumerate(nearest_dists) if d > isolation_threshold}
+    isolated_mask = nearest_dists_sq > isolation_threshold_sq
+    isolated_indices = np.flatnonzero(isolated_mask)
     
     # 孤立点以外の点で初期ルートを構築する
-    remaining_indices_for_hull = list(set(range(N)) - isolated_indices)
+    remaining_indices_for_hull = np.flatnonzero(~isolated_mask)
     
     if len(remaining_indices_for_hull) < 2:
         # ほとんどが孤立点の場合、単純な貪欲法で初期ルートを作る
@@ -53,66 +237,42 @@ def solve(cities):
         # 孤立点以外で凸包を形成
         # (この部分は簡略化し、残った点で挿入法を行う)
         tour = [remaining_indices_for_hull[0]]
-        unvisited = set(remaining_indices_for_hull[1:])
 
         # 挿入法で孤立点以外の点をルートに追加
-        while unvisited:
-            best_insertion_cost = float('inf')
-            best_point_to_insert = -1
-            best_insertion_edge_index = -1
-            
-            for point_idx in unvisited:
-                for i in range(len(tour)):
-                    u_idx, v_idx = tour[i], tour[(i + 1) % len(tour)]
-                    cost = dist_matrix[u_idx][point_idx] + dist_matrix[point_idx][v_idx] - dist_matrix[u_idx][v_idx]
-                    if cost < best_insertion_cost:
-                        best_insertion_cost = cost
-                        best_point_to_insert = point_idx
-                        best_insertion_edge_index = i
-            
-            tour.insert(best_insertion_edge_index + 1, best_point_to_insert)
-            unvisited.remove(best_point_to_insert)
+        cheapest_insertion(tour, remaining_indices_for_hull[1:], dist_matrix)
 
         # 最後に孤立点を挿入法で追加
-        unvisited_isolated = isolated_indices
-        while unvisited_isolated:
-            best_insertion_cost = float('inf')
-            best_point_to_insert = -1
-            best_insertion_edge_index = -1
-
-            for point_idx in unvisited_isolated:
-                for i in range(len(tour)):
-                    u_idx, v_idx = tour[i], tour[(i + 1) % len(tour)]
-                    cost = dist_matrix[u_idx][point_idx] + dist_matrix[point_idx][v_idx] - dist_matrix[u_idx][v_idx]
-                    if cost < best_insertion_cost:
-                        best_insertion_cost = cost
-                        best_point_to_insert = point_idx
-                        best_insertion_edge_index = i
-
-            tour.insert(best_insertion_edge_index + 1, best_point_to_insert)
-            unvisited_isolated.remove(best_point_to_insert)
-
-    # --- ステップ3: 2-opt法（改善） ---
+        cheapest_insertion(tour, isolated_indices, dist_matrix)
+
+    # --- ステップ3: 2-opt法・Or-opt法（改善） ---
+    # 各都市から近い順にNEIGHBOR_K個の都市を繋ぎ変え先の候補とする
+    # 同じ座標の都市があると自分自身が先頭に来るとは限らないので、対角を無限大にして除く
+    np.fill_diagonal(dist_matrix, np.inf)
+    neighbors = np.argsort(dist_matrix, axis=1)[:, :min(NEIGHBOR_K, N - 1)]
+    np.fill_diagonal(dist_matrix, 0.0)
+    tour = np.array(tour, dtype=np.int64)
+    # pos[city] は tour 上での city の位置
+    pos = np.empty(N, dtype=np.int64)
+    pos[tour] = np.arange(N)
+    dlb = np.zeros(N, dtype=np.bool_)
     improved = True
     while improved:
-        improved = False
-        for i in range(N - 1):
-            for j in range(i + 2, N):
-                # ループの最後と最初をつなぐ辺も考慮
-                i_plus_1 = (i + 1) % N
-                j_plus_1 = (j + 1) % N
-                
-                # 辺(i, i+1)と辺(j, j+1)を辺(i, j)と辺(i+1, j+1)に繋ぎ変える
-                current_dist = dist_matrix[tour[i]][tour[i_plus_1]] + dist_matrix[tour[j]][tour[j_plus_1]]
-                new_dist = dist_matrix[tour[i]][tour[j]] + dist_matrix[tour[i_plus_1]][tour[j_plus_1]]
-
-                if new_dist < current_dist:
-                    # ルートを改善できるなら、i+1からjまでを逆順にする
-                    sub_tour_to_reverse = tour[i_plus_1 : j + 1]
-                    tour[i_plus_1 : j + 1] = sub_tour_to_reverse[::-1]
+        improved = _two_opt(tour, pos, dist_matrix, neighbors, dlb)
+        if not improved:
+            # 2-optで改善できなくなったら、短い区間を別の場所へ移してみる
+            for seg_len in OR_OPT_SEGMENT_LENGTHS:
+                if _or_opt(tour, pos, dist_matrix, seg_len, dlb):
                     improved = True
+        if not improved:
+            # 近傍リストの外に改善できる繋ぎ変えが残っていないか、全ての辺の組を調べる
+            delta, i, j = _two_opt_best_move(tour, dist_matrix)
+            if delta < -IMPROVEMENT_EPS:
+                ends = tour[[i, i + 1, j, (j + 1) % N]]
+                _apply_two_opt(tour, pos, i, j)
+                dlb[ends] = False
+                improved = True
 
-    return tour
+    return tour.tolist()
 
 if __name__ == '__main__':
     assert len(sys.argv) > 1
@@ -1,12 +1,120 @@
 #!/usr/bin/env python3
 
 import sys
-import math
+
+import numpy as np
+from numba import njit
+from scipy.spatial.distance import cdist, pdist, squareform
+
 from common import print_tour, read_input
 
-def distance(city1, city2):
-    """2つの都市間のユークリッド距離を計算する"""
-    return math.sqrt((city1[0] - city2[0]) ** 2 + (city1[1] - city2[1]) ** 2)
+# これより都市数が多い場合は上三角だけを計算する pdist を使う
+PDIST_THRESHOLD = 5000
+# 3-optで2本目・3本目の辺の候補にする近傍都市の数
+NEIGHBOR_K = 20
+# 浮動小数点の誤差で同じ繋ぎ変えを繰り返さないよう、これより大きく改善する場合だけ採用する
+IMPROVEMENT_EPS = 1e-3
+
+def cheapest_insertion(tour, points, dist_matrix):
+    """挿入コストが最小になる点と位置を毎回選びながら、pointsの点を全てtourに挿入する"""
+    unvisited = list(points)
+    # route[:L] が現在のルート。route[L] に先頭の都市を置いておき、(i + 1) % L の計算を省く
+    L = len(tour)
+    route = np.empty(L + len(unvisited) + 1, dtype=np.int64)
+    route[:L] = tour
+    route[L] = route[0]
+    while unvisited:
+        U = np.array(unvisited)
+        # rows[e] は route[e] から各未訪問点までの距離で、辺eの始点と辺e-1の終点で共用する
+        rows = dist_matrix[np.ix_(route[:L + 1], U)]
+        edge_lens = dist_matrix[route[:L], route[1:L + 1]]
+        # cost[e, k] は辺(route[e], route[e+1])の間に点U[k]を挿入したときの経路長の増分
+        cost = rows[:-1] + rows[1:] - edge_lens[:, None]
+        edge_idx, k = np.unravel_index(cost.argmin(), cost.shape)
+        # 挿入位置より後ろを末尾の番兵ごと1つずらして空きを作る
+        route[edge_idx + 2:L + 2] = route[edge_idx + 1:L + 1]
+        route[edge_idx + 1] = unvisited.pop(k)
+        L += 1
+    tour[:] = route[:L].tolist()
+
+@njit(cache=True, fastmath=True)
+def _three_opt_pass(tour, pos, dist, neighbors, buf):
+    """
+    3-opt法で改善できる繋ぎ変えを1つ探して適用し、見つかったかどうかを返す
+    pos[city] は tour 上での city の位置で、bufは繋ぎ変え後の並びを組み立てる作業領域
+    """
+    N = tour.shape[0]
+    # 3つの「辺」を選ぶ。辺は (tour[i], tour[i+1]) のように定義される
+    for i in range(N):
+        # 2本目の辺は tour[i] の近傍都市から始まるものだけを調べる
+        for j in np.sort(pos[neighbors[tour[i]]]):
+            if j < i + 2: continue
+            # 3本目の辺は tour[j+1] の近傍都市で終わるものだけを調べる
+            for k in np.sort(pos[neighbors[tour[(j + 1) % N]]]):
+                # ループの終端を考慮 (i=0のときは辺(k, k+1)が辺(i, i+1)と接するのでkはN-2まで)
+                if k < j + 2 or (i == 0 and k == N - 1): continue
+
+                # 辺(i, i+1), (j, j+1), (k, k+1) を切断する
+                # インデックスがNを超える場合は %N で巡回させる
+                A, B = tour[i], tour[(i + 1) % N]
+                C, D = tour[j], tour[(j + 1) % N]
+                E, F = tour[k], tour[(k + 1) % N]
+
+                # 8通りの繋ぎ変えパターンを試し、最も良いものを探す
+                # d0が現在のコスト
+                d0 = dist[A, B] + dist[C, D] + dist[E, F]
+
+                # 2-optの繋ぎ変えパターン
+                d1 = dist[A, C] + dist[B, D] + dist[E, F] # (A,C),(B,D)
+                d2 = dist[A, B] + dist[C, E] + dist[D, F] # (C,E),(D,F)
+                d3 = dist[A, E] + dist[F, B] + dist[C, D] # (A,E),(F,B)
+
+                # 3-optの繋ぎ変えパターン
+                d4 = dist[A, C] + dist[B, E] + dist[D, F]
+                d5 = dist[A, D] + dist[E, B] + dist[C, F]
+                d6 = dist[A, D] + dist[E, C] + dist[B, F]
+                d7 = dist[A, E] + dist[F, C] + dist[B, D]
+
+                # 最もコストが低い繋ぎ変えを探す
+                best_dist = min(d0, d1, d2, d3, d4, d5, d6, d7)
+
+                if best_dist < d0 - IMPROVEMENT_EPS:
+                    # 改善が見つかった場合、i+1からkまでの並びだけをその場で書き換える
+                    # セグメントを定義 (i+1からjまで、j+1からkまで)
+                    # 新しい並びは使い回しのバッファに組み立ててから書き戻す
+                    s1 = tour[i+1 : j+1]
+                    s2 = tour[j+1 : k+1]
+                    n1, n2, m = j - i, k - j, k - i
+
+                    if best_dist == d1: # 2-opt: i+1..j を反転
+                        buf[:n1] = s1[::-1]
+                        buf[n1:m] = s2
+                    elif best_dist == d2: # 2-opt: j+1..k を反転
+                        buf[:n1] = s1
+                        buf[n1:m] = s2[::-1]
+                    elif best_dist == d3: # 2-opt: i+1..k を反転
+                        buf[:n2] = s2[::-1]
+                        buf[n2:m] = s1[::-1]
+                    elif best_dist == d4: # 3-opt
+                        buf[:n1] = s1[::-1]
+                        buf[n1:m] = s2[::-1]
+                    elif best_dist == d5: # 3-opt
+                        buf[:n2] = s2
+                        buf[n2:m] = s1
+                    elif best_dist == d6: # 3-opt: (A,D),(E,C),(B,F)
+                        buf[:n2] = s2
+                        buf[n2:m] = s1[::-1]
+                    elif best_dist == d7: # 3-opt: (A,E),(D,B),(C,F)
+                        buf[:n2] = s2[::-1]
+                        buf[n2:m] = s1
+
+                    tour[i+1 : k+1] = buf[:m]
+                    for p in range(i + 1, k + 1):
+                        pos[tour[p]] = p
+
+                    # 改善したので最初から調べ直す
+                    return True
+    return False
 
 def solve(cities):
     """
@@ -15,129 +123,63 @@ def solve(cities):
     2. 構築: 挿入法で質の高い初期ルートを作成する
     3. 改善: 3-opt法でルートを局所最適化し、より複雑な交差を解消する
     """
-    N = len(cities)
+    pts = np.asarray(cities, dtype=np.float64)
+    N = pts.shape[0]
     if N == 0:
         return []
 
-    # 全ての都市間の距離を事前に計算しておく
-    dist_matrix = [[0] * N for _ in range(N)]
-    for i in range(N):
-        for j in range(i, N):
-            dist_matrix[i][j] = dist_matrix[j][i] = distance(cities[i], cities[j])
+    # 全ての都市間の距離の2乗を事前に計算しておく
+    # 局所探索はメモリ帯域が律速になるので、float32で持って転送量を半分にする
+    if N > PDIST_THRESHOLD:
+        dist_sq = squareform(pdist(pts, 'sqeuclidean').astype(np.float32))
+    else:
+        dist_sq = cdist(pts, pts, 'sqeuclidean').astype(np.float32)
 
     # --- ステップ1: 孤立点の処理（前処理）---
-    nearest_dists = [min(dist_matrix[i][j] for j in range(N) if i != j) if N > 1 else 0 for i in range(N)]
-    avg_nearest_dist = sum(nearest_dists) / N if N > 0 else 0
-    isolation_threshold = avg_nearest_dist * 1.5 
-    isolated_indices = {i for i, d in enumerate(nearest_dists) if d > isolation_threshold}
-    remaining_indices = list(set(range(N)) - isolated_indices)
+    # 最近傍の判定は2乗距離のまま行い、平方根は最小値N個に対してだけ取る
+    if N > 1:
+        np.fill_diagonal(dist_sq, np.inf)
+        nearest_dists_sq = dist_sq.min(axis=1)
+        np.fill_diagonal(dist_sq, 0.0)
+    else:
+        nearest_dists_sq = np.zeros(N, dtype=np.float32)
+    dist_matrix = np.sqrt(dist_sq, out=dist_sq)
+    avg_nearest_dist = np.sqrt(nearest_dists_sq).mean()
+    isolation_threshold_sq = (avg_nearest_dist * 1.5) ** 2
+    isolated_mask = nearest_dists_sq > isolation_threshold_sq
+    isolated_indices = np.flatnonzero(isolated_mask)
+    remaining_indices = np.flatnonzero(~isolated_mask)
     
-    if not remaining_indices:
-        remaining_indices = list(range(N))
-        isolated_indices = set()
+    if remaining_indices.size == 0:
+        remaining_indices = np.arange(N)
+        isolated_indices = np.array([], dtype=np.int64)
     
     # --- ステップ2: 挿入法（構築） ---
     tour = [remaining_indices[0]]
-    unvisited = set(remaining_indices[1:])
     
     # 挿入法で孤立点以外の点をルートに追加
-    while unvisited:
-        best_cost, best_point, best_edge_idx = float('inf'), -1, -1
-        for point_idx in unvisited:
-            for i in range(len(tour)):
-                u, v = tour[i], tour[(i + 1) % len(tour)]
-                cost = dist_matrix[u][point_idx] + dist_matrix[point_idx][v] - dist_matrix[u][v]
-                if cost < best_cost: best_cost, best_point, best_edge_idx = cost, point_idx, i
-        tour.insert(best_edge_idx + 1, best_point)
-        unvisited.remove(best_point)
+    cheapest_insertion(tour, remaining_indices[1:], dist_matrix)
 
     # 最後に孤立点を挿入法で追加
-    while isolated_indices:
-        best_cost, best_point, best_edge_idx = float('inf'), -1, -1
-        for point_idx in isolated_indices:
-            for i in range(len(tour)):
-                u, v = tour[i], tour[(i + 1) % len(tour)]
-                cost = dist_matrix[u][point_idx] + dist_matrix[point_idx][v] - dist_matrix[u][v]
-                if cost < best_cost: best_cost, best_point, best_edge_idx = cost, point_idx, i
-        tour.insert(best_edge_idx + 1, best_point)
-        isolated_indices.remove(best_point)
+    cheapest_insertion(tour, isolated_indices, dist_matrix)
 
     # --- ステップ3: 3-opt法（改善） ---
-    # 注意: この処理は O(N^3) のため、Nが大きいと非常に時間がかかります。
+    # 各都市から近い順にNEIGHBOR_K個の都市を2本目・3本目の辺の候補とし、1周を O(N * NEIGHBOR_K^2) に抑える
+    # 同じ座標の都市があると自分自身が先頭に来るとは限らないので、対角を無限大にして除く
+    np.fill_diagonal(dist_matrix, np.inf)
+    neighbors = np.argsort(dist_matrix, axis=1)[:, :min(NEIGHBOR_K, N - 1)]
+    np.fill_diagonal(dist_matrix, 0.0)
+    tour = np.array(tour, dtype=np.int64)
+    # pos[city] は tour 上での city の位置
+    pos = np.empty(N, dtype=np.int64)
+    pos[tour] = np.arange(N)
+    # 繋ぎ変え後の並びを組み立てるための作業領域（毎回確保しないよう使い回す）
+    buf = np.empty(N, dtype=np.int64)
     improved = True
     while improved:
-        improved = False
-        # 3つの「辺」を選ぶ。辺は (tour[i], tour[i+1]) のように定義される
-        for i in range(N):
-            for j in range(i + 2, N):
-                for k in range(j + 2, N + (1 if i > 0 else 0)):
-                    # ループの終端を考慮 (i=0のときはkがN-1まで)
-                    if k >= N : continue
-
-                    # 辺(i, i+1), (j, j+1), (k, k+1) を切断する
-                    # インデックスがNを超える場合は %N で巡回させる
-                    A, B = tour[i], tour[(i + 1) % N]
-                    C, D = tour[j], tour[(j + 1) % N]
-                    E, F = tour[k], tour[(k + 1) % N]
-
-                    # 8通りの繋ぎ変えパターンを試し、最も良いものを探す
-                    # d0が現在のコスト
-                    d0 = dist_matrix[A][B] + dist_matrix[C][D] + dist_matrix[E][F]
-                    
-                    # 2-optの繋ぎ変えパターン
-                    d1 = dist_matrix[A][C] + dist_matrix[B][D] + dist_matrix[E][F] # (A,C),(B,D)
-                    d2 = dist_matrix[A][B] + dist_matrix[C][E] + dist_matrix[D][F] # (C,E),(D,F)
-                    d3 = dist_matrix[A][E] + dist_matrix[F][B] + dist_matrix[C][D] # (A,E),(F,B)
-                    
-                    # 3-optの繋ぎ変えパターン
-                    d4 = dist_matrix[A][C] + dist_matrix[B][E] + dist_matrix[D][F]
-                    d5 = dist_matrix[A][D] + dist_matrix[E][B] + dist_matrix[C][F]
-                    d6 = dist_matrix[A][D] + dist_matrix[E][C] + dist_matrix[B][F]
-                    d7 = dist_matrix[A][E] + dist_matrix[F][C] + dist_matrix[B][D]
-
-                    # 最もコストが低い繋ぎ変えを探す
-                    best_dist = min(d0, d1, d2, d3, d4, d5, d6, d7)
-
-                    if best_dist < d0:
-                        # 改善が見つかった場合、安全な方法でルートを更新
-                        # セグメントを定義 (i+1からjまで、j+1からkまで)
-                        # tourを直接スライスで書き換えるのではなく、部分を逆順にする
-                        s1 = tour[i+1 : j+1]
-                        s2 = tour[j+1 : k+1]
-                        
-                        new_tour = tour[:i+1]
-
-                        if best_dist == d1: # 2-opt: i+1..j を反転
-                            new_tour.extend(s1[::-1])
-                            new_tour.extend(s2)
-                        elif best_dist == d2: # 2-opt: j+1..k を反転
-                            new_tour.extend(s1)
-                            new_tour.extend(s2[::-1])
-                        elif best_dist == d3: # 2-opt: i+1..k を反転
-                            new_tour.extend((s1+s2)[::-1])
-                        elif best_dist == d4: # 3-opt
-                            new_tour.extend(s1[::-1])
-                            new_tour.extend(s2[::-1])
-                        elif best_dist == d5: # 3-opt
-                            new_tour.extend(s2)
-                            new_tour.extend(s1)
-                        elif best_dist == d6: # 3-opt
-                            new_tour.extend(s2[::-1])
-                            new_tour.extend(s1)
-                        elif best_dist == d7: # 3-opt
-                            new_tour.extend(s2)
-                            new_tour.extend(s1[::-1])
-                        
-                        # tourの末尾（k+1以降）を追加
-                        new_tour.extend(tour[k+1:])
-                        tour = new_tour
-                        
-                        improved = True
-                        break # 改善したので内側のループから抜ける
-                if improved: break
-            if improved: break
-
-    return tour
+        improved = _three_opt_pass(tour, pos, dist_matrix, neighbors, buf)
+
+    return tour.tolist()
 
 if __name__ == '__main__':
     if len(sys.argv) < 2: